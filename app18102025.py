@@ -150,6 +150,8 @@ def get_complete_menu_name(order_text):
     
     return best_match if best_match else order_text
 
+from order_quantities import bind_quantities
+
 def calculate_order_total(order_text):
     """Calculate estimated total for Facebook orders based on menu items"""
     load_pricing_config()
@@ -167,27 +169,20 @@ def calculate_order_total(order_text):
         if category != "free_requests":  # Skip free requests from pricing
             all_pricing.update(items)
     
-    # Count quantities and calculate total
+    # Find the items, then give each the quantity written next to it
+    # (not the first number anywhere in the message)
+    found_items = []
+    spans = []
     for item, price in all_pricing.items():
         if item in text_lower:
-            # Try to extract quantity
-            quantity = 1
-            for qty_word in ["1", "2", "3", "4", "5", "one", "two", "three", "four", "five"]:
-                if qty_word in text_lower:
-                    if qty_word.isdigit():
-                        quantity = int(qty_word)
-                    elif qty_word == "two":
-                        quantity = 2
-                    elif qty_word == "three":
-                        quantity = 3
-                    elif qty_word == "four":
-                        quantity = 4
-                    elif qty_word == "five":
-                        quantity = 5
-                    break
-            
-            total += quantity * price
-            logger.info(f"Found item '{item}' with quantity {quantity} at ₱{price} each = ₱{quantity * price}")
+            position = text_lower.find(item)
+            found_items.append({"name": item, "quantity": 1, "price": price, "total": price})
+            spans.append((position, position + len(item)))
+    bind_quantities(text_lower, found_items, spans)
+    
+    for found in found_items:
+        total += found["total"]
+        logger.info(f"Found item '{found['name']}' with quantity {found['quantity']} at ₱{found['price']} each = ₱{found['total']}")
     
     logger.info(f"Total calculated: ₱{total}")
     return total
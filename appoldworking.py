@@ -6,6 +6,8 @@ FIXED VERSION - Now includes complete_menu_name for proper sales reporting
 import os
 import json
 import logging
+import re
+from collections import OrderedDict
 from flask import Flask, request, Response
 try:
     from flask_cors import CORS
@@ -16,6 +18,7 @@ except ImportError:
 import requests
 from datetime import datetime, time, date, timedelta
 from zoneinfo import ZoneInfo
+from order_quantities import QUANTITY_WORDS, bind_quantities
 
 app = Flask(__name__)
 if CORS_AVAILABLE:
@@ -38,12 +41,15 @@ SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "eyJhbGciOiJIUzI1NiIsInR5cCI6
 CONFIG_FILE = "config.json"
 MENU_CONFIG_FILE = "menu_config.json"
 PRICING_CONFIG_FILE = "pricing_config.json"
+CATEGORY_MENU_FILE = "category_menu.json"
 config = {}
 menu_config = {}
 pricing_config = {}
+category_menu = {}
 config_last_modified = None
 menu_config_last_modified = None
 pricing_config_last_modified = None
+category_menu_last_modified = None
 
 def load_config():
     global config, config_last_modified
@@ -104,9 +110,27 @@ def load_pricing_config():
         logger.error(f"Error loading pricing config: {e}")
         pricing_config = {"pricing": {}}
 
+def load_category_menu():
+    global category_menu, category_menu_last_modified
+    try:
+        if os.path.exists(CATEGORY_MENU_FILE):
+            current_modified = os.path.getmtime(CATEGORY_MENU_FILE)
+            if category_menu_last_modified != current_modified:
+                with open(CATEGORY_MENU_FILE, 'r') as f:
+                    category_menu = json.load(f)
+                category_menu_last_modified = current_modified
+                logger.info(f"Category menu loaded from {CATEGORY_MENU_FILE}")
+        elif not category_menu:
+            logger.warning(f"{CATEGORY_MENU_FILE} not found, no variation prompts")
+            category_menu = {"menu_categories": {}}
+    except Exception as e:
+        logger.error(f"Error loading category menu: {e}")
+        category_menu = {"menu_categories": {}}
+
 load_config()
 load_menu_config()
 load_pricing_config()
+load_category_menu()
 
 def get_config_value(key_path, default=None):
     load_config()
@@ -121,139 +145,201 @@ def get_config_value(key_path, default=None):
 
 def get_complete_menu_name(order_text):
     """Get the complete menu name for the order"""
-    load_menu_config()
-    
-    if not menu_config or not menu_config.get("menu_items"):
-        return order_text  # Fallback to original text
-    
-    text_lower = order_text.lower().strip()
-    all_menu_items = []
-    
-    # Get all menu items from all categories
-    for category, items in menu_config.get("menu_items", {}).items():
-        all_menu_items.extend(items)
-    
-    # Find the best match - prioritize longer, more specific matches
-    best_match = None
-    best_score = 0
-    
-    # Sort items by length (longest first) to prioritize specific matches
-    sorted_items = sorted(all_menu_items, key=len, reverse=True)
-    
-    for item in sorted_items:
-        item_lower = item.lower()
-        
-        # Direct match (highest priority)
-        if item_lower in text_lower:
-            return item
-            
-        # Flexible matching
-        item_clean = item_lower.replace(' w/', ' ').replace(' with ', ' ').replace(' & ', ' and ')
-        text_clean = text_lower.replace(' w/', ' ').replace(' with ', ' ').replace(' & ', ' and ')
-        
-        if item_clean in text_clean:
-            return item
-            
-        # Word-based matching
-        item_words = [word for word in item_clean.split() if len(word) > 2]
-        text_words = [word for word in text_clean.split() if len(word) > 2]
-        matching_words = [word for word in item_words if word in text_words]
-        
-        if len(matching_words) >= 2 and len(matching_words) > best_score:
-            best_match = item
-            best_score = len(matching_words)
-    
-    return best_match if best_match else order_text
+    return analyze_order(order_text).complete_menu_name or order_text
+
+# Order text matching
+# Every string parse_order_items looks for (priced item names, their base and
+# "with" forms, size words, special-case phrases) is compiled into
+# one Aho-Corasick automaton per pricing_config version. An order is scanned
+# once and all later checks are lookups in the recorded match positions; the
+# matching rules themselves (first occurrence, word boundaries, +/-20 character
+# size windows) are unchanged. Quantities are tokenized in order_quantities.py.
+SIZE_VARIATIONS = [" small", " double", " large", " medium", " solo", " w/ rice", " w/", " with rice", " with"]
+SIZE_WORDS = ["small", "double", "large", "medium", "solo"]
+YANGCHOW_PROTEINS = ["pork tonkatsu", "sweet & sour pork", "chicken fillet", "general tso chicken", "lechon kawali"]
+
+class PatternMatcher:
+    """Aho-Corasick automaton over a fixed set of patterns"""
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern in set(patterns):
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(pattern)
+        # Breadth-first pass for failure links; outputs inherit from their fail state
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def scan(self, text):
+        """Return TextMatches with the start offsets of every pattern occurrence"""
+        occurrences = {}
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern in self.output[state]:
+                occurrences.setdefault(pattern, []).append(position - len(pattern) + 1)
+        return TextMatches(text, occurrences)
+
+class TextMatches:
+    """Answers `in`, find() and window checks for one text from recorded occurrences"""
+    def __init__(self, text, occurrences):
+        self.text = text
+        self.occurrences = occurrences
+
+    def __contains__(self, pattern):
+        return not pattern or pattern in self.occurrences
+
+    def find(self, pattern):
+        if not pattern:
+            return 0
+        starts = self.occurrences.get(pattern)
+        return starts[0] if starts else -1
+
+    def in_slice(self, pattern, start, end):
+        """Same as `pattern in text[start:end]`"""
+        start, end, _ = slice(start, end).indices(len(self.text))
+        return any(start <= found and found + len(pattern) <= end for found in self.occurrences.get(pattern, ()))
+
+    def is_word_at(self, position, length):
+        """True if text[position:position + length] is not part of a longer word"""
+        if position > 0 and self.text[position - 1].isalnum():
+            return False
+        if position + length < len(self.text) and self.text[position + length].isalnum():
+            return False
+        return True
+
+    def context_size(self, position, length):
+        for variation in SIZE_WORDS:
+            if self.in_slice(variation, position - 20 if position >= 20 else 0, position + length + 20):
+                return variation
+        return None
+
+def strip_variations(name, variations=SIZE_VARIATIONS):
+    for variation in variations:
+        name = name.replace(variation, "")
+    return name
+
+class PricingMatcher:
+    """Pricing table plus everything parse_items derives from it, compiled once"""
+    def __init__(self, pricing):
+        self.configured = bool(pricing and pricing.get("pricing"))
+        self.all_pricing = {}
+        for category, items in pricing.get("pricing", {}).items():
+            if category != "free_requests":  # Skip free requests from pricing
+                self.all_pricing.update(items)
+        self.items = []
+        for item, price in sorted(self.all_pricing.items(), key=lambda x: len(x[0]), reverse=True):
+            item_lower = item.lower()
+            base_name = strip_variations(item_lower)
+            base_name_normalized = strip_variations(item_lower, [" small", " double", " large", " medium", " solo", " w/ rice", " with rice"]).replace(" w/", " with")
+            self.items.append({
+                "name": item,
+                "price": price,
+                "lower": item_lower,
+                "base": base_name,
+                "test_names": [base_name, base_name.replace("w/", "with"), base_name_normalized]
+            })
+        # An item can only match if one of its trigger patterns occurs in the text
+        self.triggers = {}
+        for index, entry in enumerate(self.items):
+            triggers = [entry["lower"]] + entry["test_names"]
+            if "yangchow" in entry["lower"]:
+                triggers.extend(protein for protein in YANGCHOW_PROTEINS if protein in entry["lower"])
+            if "peri peri chicken w/ rice" in entry["lower"]:
+                triggers.append("peri peri chicken")
+            if "sweet and spicy pork ribs" in entry["lower"]:
+                triggers.append("spicy pork ribs")
+            for pattern in triggers:
+                self.triggers.setdefault(pattern, set()).add(index)
+        # Base items used when nothing matched: lowest price per name without size
+        self.base_items = {}
+        for item, price in self.all_pricing.items():
+            base_name = strip_variations(item.lower(), [" small", " double", " large", " medium", " solo"])
+            if base_name not in self.base_items or price < self.base_items[base_name]:
+                self.base_items[base_name] = price
+        self.bases = {}
+        # Everything parse_items looks up in the lowercased order text
+        self.patterns = SIZE_WORDS + YANGCHOW_PROTEINS + ["peri peri chicken", "spicy pork ribs", "spicy pork strips"]
+        for entry in self.items:
+            self.patterns.append(entry["lower"])
+            self.patterns.extend(entry["test_names"])
+        self.patterns.extend(self.base_items)
+
+    def base_of(self, name):
+        """strip_variations(name.lower()), memoized for names of parsed items"""
+        base = self.bases.get(name)
+        if base is None:
+            base = self.bases[name] = strip_variations(name.lower())
+        return base
 
 def parse_order_items(order_text):
     """Parse order text and return individual items with their details"""
-    load_pricing_config()
-    
-    if not pricing_config or not pricing_config.get("pricing"):
+    return [dict(item) for item in analyze_order(order_text).parsed_items]
+
+def parse_items(compiled, text, order_text, mentions=()):
+    """Priced items in an order, given its scanned lowercase text"""
+    if not compiled.configured:
         logger.warning("No pricing configuration found, returning empty list")
         return []
     
-    text_lower = order_text.lower().strip()
     parsed_items = []
+    spans = []  # (start, end) of each parsed item in the text, for quantity binding
     
     logger.info(f"Parsing order items for: '{order_text}'")
     
-    # Get all pricing from the external file (excluding free requests)
-    all_pricing = {}
-    for category, items in pricing_config.get("pricing", {}).items():
-        if category != "free_requests":  # Skip free requests from pricing
-            all_pricing.update(items)
-    
+    all_pricing = compiled.all_pricing
     logger.info(f"Loaded {len(all_pricing)} pricing items from config")
     
+    # The scan already found every pattern occurrence, and with it the only
+    # items that can match
+    candidates = sorted({index for pattern in text.occurrences for index in compiled.triggers.get(pattern, ())})
+    
     # Count quantities and calculate total - find ALL matching items
     # Use a two-pass approach: exact matches first, then flexible matches
-    
-    # First pass: Look for exact matches (including customer-specified variations)
-    # Sort by length first (longest matches first) to prioritize specific variations
-    sorted_items_by_length = sorted(all_pricing.items(), key=lambda x: len(x[0]), reverse=True)
-    
-    # Process exact matches first (prioritize customer-specified variations)
-    for item, price in sorted_items_by_length:
-        item_lower = item.lower()
+    # Items are pre-sorted longest first to prioritize specific variations
+    for entry in (compiled.items[index] for index in candidates):
+        item, price, item_lower = entry["name"], entry["price"], entry["lower"]
         
         # Try exact match first
-        if item_lower in text_lower:
-            # Check if this is a valid match (not a substring within another word)
-            item_position = text_lower.find(item_lower)
-            
-            # Check if the match is a complete word (not part of another word)
-            is_valid_match = True
+        if item_lower in text:
+            item_position = text.find(item_lower)
             
-            # Check character before the match
-            if item_position > 0:
-                char_before = text_lower[item_position - 1]
-                if char_before.isalnum():
-                    is_valid_match = False
-            
-            # Check character after the match
-            if item_position + len(item_lower) < len(text_lower):
-                char_after = text_lower[item_position + len(item_lower)]
-                if char_after.isalnum():
-                    is_valid_match = False
-            
-            # Skip if not a valid word match
-            if not is_valid_match:
+            # Skip if not a valid word match (not a substring within another word)
+            if not text.is_word_at(item_position, len(item_lower)):
                 logger.info(f"Skipping '{item}' - found as substring in another word")
                 continue
             
             # Check if we already found a match for this base item (avoid duplicates)
             base_already_found = False
             existing_item_to_replace = None
-            
-            # Extract base item name (remove size variations)
-            base_name = item_lower
-            for variation in [" small", " double", " large", " medium", " solo", " w/ rice", " w/", " with rice", " with"]:
-                base_name = base_name.replace(variation, "")
+            base_name = entry["base"]
             
             for i, parsed_item in enumerate(parsed_items):
-                # Extract the item name from the parsed item
                 found_item_name = parsed_item["name"].lower()
                 
-                # Check if this is the same base item by comparing the core item name
-                # Remove size variations from both items and compare
-                found_base = found_item_name
-                for variation in [" small", " double", " large", " medium", " solo", " w/ rice", " w/", " with rice", " with"]:
-                    found_base = found_base.replace(variation, "")
-                
-                # Check if the base items are the same
-                if base_name == found_base:
+                # Same base item once size variations are removed from both
+                if base_name == compiled.base_of(parsed_item["name"]):
                     # Check if the current item has a customer-specified variation near this item
-                    customer_specified_variation = None
-                    # Find the position of the matched text for context
-                    item_position = text_lower.find(item_lower)
-                    
-                    if item_position >= 0:
-                        item_context = text_lower[max(0, item_position-20):item_position+len(item_lower)+20]
-                        for variation in ["small", "double", "large", "medium", "solo"]:
-                            if variation in item_context:
-                                customer_specified_variation = variation
-                                break
+                    customer_specified_variation = text.context_size(item_position, len(item_lower))
                     
                     # If customer specified a variation, prioritize that over the existing match
                     if customer_specified_variation and customer_specified_variation in item_lower:
@@ -271,98 +357,42 @@ def parse_order_items(order_text):
                         break
             
             if not base_already_found and existing_item_to_replace is None:
-                # Try to extract quantity for this specific item
-                quantity = 1
-                
-                # Look for quantity words near this item
-                item_context = text_lower[max(0, item_position-20):item_position+len(item_lower)+20]
-                
-                for qty_word in ["1", "2", "3", "4", "5", "one", "two", "three", "four", "five"]:
-                    if qty_word in item_context:
-                        if qty_word.isdigit():
-                            quantity = int(qty_word)
-                        elif qty_word == "two":
-                            quantity = 2
-                        elif qty_word == "three":
-                            quantity = 3
-                        elif qty_word == "four":
-                            quantity = 4
-                        elif qty_word == "five":
-                            quantity = 5
-                        break
-                
                 parsed_items.append({
                     "name": item,
-                    "quantity": quantity,
+                    "quantity": 1,
                     "price": price,
-                    "total": quantity * price
+                    "total": price
                 })
-                logger.info(f"Found item '{item}' with quantity {quantity} at ₱{price} each = ₱{quantity * price}")
+                spans.append((item_position, item_position + len(item_lower)))
+                logger.info(f"Found item '{item}' at ₱{price} each")
             elif existing_item_to_replace is not None:
                 # Replace the existing item with the customer-specified variation
                 old_item = parsed_items[existing_item_to_replace]
                 
-                # Try to extract quantity for this specific item
-                quantity = 1
-                
-                # Look for quantity words near this item
-                item_context = text_lower[max(0, item_position-20):item_position+len(item_lower)+20]
-                
-                for qty_word in ["1", "2", "3", "4", "5", "one", "two", "three", "four", "five"]:
-                    if qty_word in item_context:
-                        if qty_word.isdigit():
-                            quantity = int(qty_word)
-                        elif qty_word == "two":
-                            quantity = 2
-                        elif qty_word == "three":
-                            quantity = 3
-                        elif qty_word == "four":
-                            quantity = 4
-                        elif qty_word == "five":
-                            quantity = 5
-                        break
-                
                 parsed_items[existing_item_to_replace] = {
                     "name": item,
-                    "quantity": quantity,
+                    "quantity": 1,
                     "price": price,
-                    "total": quantity * price
+                    "total": price
                 }
-                logger.info(f"Replaced '{old_item['name']}' with '{item}' with quantity {quantity} at ₱{price} each = ₱{quantity * price}")
+                spans[existing_item_to_replace] = (item_position, item_position + len(item_lower))
+                logger.info(f"Replaced '{old_item['name']}' with '{item}' at ₱{price} each")
             else:
                 logger.info(f"Skipping '{item}' - base item already found")
         
         # Try flexible matching for items with size variations
         else:
-            # Extract base item name (remove size variations and common variations)
-            base_name = item_lower
-            for variation in [" small", " double", " large", " medium", " solo", " w/ rice", " w/", " with rice", " with"]:
-                base_name = base_name.replace(variation, "")
+            base_name = entry["base"]
             
             # Special handling for yangchow items - check if order contains the protein
             if "yangchow" in item_lower:
-                # Check if order contains the protein (with or without "yangchow")
-                yangchow_proteins = ["pork tonkatsu", "sweet & sour pork", "chicken fillet", "general tso chicken", "lechon kawali"]
-                for protein in yangchow_proteins:
+                for protein in YANGCHOW_PROTEINS:
                     if protein in item_lower:
                         # Check if this protein is mentioned in the order
-                        if protein in text_lower:
+                        if protein in text:
                             # This is a flexible match for yangchow w/ [protein]
-                            item_position = text_lower.find(protein)
-                            is_valid_match = True
-                            
-                            # Check if this is a valid match (not a substring within another word)
-                            if item_position > 0:
-                                char_before = text_lower[item_position - 1]
-                                if char_before.isalnum():
-                                    is_valid_match = False
-                            
-                            if item_position + len(protein) < len(text_lower):
-                                char_after = text_lower[item_position + len(protein)]
-                                if char_after.isalnum():
-                                    is_valid_match = False
-                            
-                            if is_valid_match:
+                            item_position = text.find(protein)
+                            if text.is_word_at(item_position, len(protein)):
                                 # Check if we already found a match for this item
                                 item_already_found = any("yangchow" in parsed_item["name"].lower() for parsed_item in parsed_items)
                                 if not item_already_found:
@@ -372,26 +402,14 @@ def parse_order_items(order_text):
                                         "price": price,
                                         "total": price
                                     })
-                                    logger.info(f"Found yangchow item '{item}' for '{protein}' with quantity 1 at ₱{price}")
+                                    spans.append((item_position, item_position + len(protein)))
+                                    logger.info(f"Found yangchow item '{item}' for '{protein}' at ₱{price}")
                                 break
                 continue
             
             # Special handling for "peri peri chicken" -> "peri peri chicken w/ rice"
-            if "peri peri chicken" in text_lower and "peri peri chicken w/ rice" in item_lower:
-                item_position = text_lower.find("peri peri chicken")
-                is_valid_match = True
-                
-                if item_position > 0:
-                    char_before = text_lower[item_position - 1]
-                    if char_before.isalnum():
-                        is_valid_match = False
-                
-                if item_position + len("peri peri chicken") < len(text_lower):
-                    char_after = text_lower[item_position + len("peri peri chicken")]
-                    if char_after.isalnum():
-                        is_valid_match = False
-                
-                if is_valid_match:
+            if "peri peri chicken" in text and "peri peri chicken w/ rice" in item_lower:
+                if text.is_word_at(text.find("peri peri chicken"), len("peri peri chicken")):
                     # Check if we already found a match for this item
                     item_already_found = any("peri peri chicken" in parsed_item["name"].lower() for parsed_item in parsed_items)
                     if not item_already_found:
@@ -401,25 +419,14 @@ def parse_order_items(order_text):
                             "price": price,
                             "total": price
                         })
-                        logger.info(f"Found peri peri chicken item '{item}' for 'peri peri chicken' with quantity 1 at ₱{price}")
+                        item_position = text.find("peri peri chicken")
+                        spans.append((item_position, item_position + len("peri peri chicken")))
+                        logger.info(f"Found peri peri chicken item '{item}' for 'peri peri chicken' at ₱{price}")
                 continue
             
             # Special handling for "spicy pork ribs" -> "sweet and spicy pork ribs"
-            if "spicy pork ribs" in text_lower and "sweet and spicy pork ribs" in item_lower:
-                item_position = text_lower.find("spicy pork ribs")
-                is_valid_match = True
-                
-                if item_position > 0:
-                    char_before = text_lower[item_position - 1]
-                    if char_before.isalnum():
-                        is_valid_match = False
-                
-                if item_position + len("spicy pork ribs") < len(text_lower):
-                    char_after = text_lower[item_position + len("spicy pork ribs")]
-                    if char_after.isalnum():
-                        is_valid_match = False
-                
-                if is_valid_match:
+            if "spicy pork ribs" in text and "sweet and spicy pork ribs" in item_lower:
+                if text.is_word_at(text.find("spicy pork ribs"), len("spicy pork ribs")):
                     # Check if we already found a match for this item
                     item_already_found = any("spicy pork ribs" in parsed_item["name"].lower() for parsed_item in parsed_items)
                     if not item_already_found:
@@ -429,11 +436,13 @@ def parse_order_items(order_text):
                             "price": price,
                             "total": price
                         })
-                        logger.info(f"Found spicy pork ribs item '{item}' for 'spicy pork ribs' with quantity 1 at ₱{price}")
+                        item_position = text.find("spicy pork ribs")
+                        spans.append((item_position, item_position + len("spicy pork ribs")))
+                        logger.info(f"Found spicy pork ribs item '{item}' for 'spicy pork ribs' at ₱{price}")
                 continue
             
             # Special handling for "spicy pork strips" - prevent duplicate matching
-            if "spicy pork strips" in text_lower and "spicy pork strips" in item_lower:
+            if "spicy pork strips" in text and "spicy pork strips" in item_lower:
                 # Check if we already found a match for this item
                 item_already_found = any("spicy pork strips" in parsed_item["name"].lower() for parsed_item in parsed_items)
                 if item_already_found:
@@ -442,9 +451,9 @@ def parse_order_items(order_text):
                 
                 # Check if customer specified a size variation
                 customer_specified_size = None
-                if "small" in text_lower:
+                if "small" in text:
                     customer_specified_size = "small"
-                elif "double" in text_lower:
+                elif "double" in text:
                     customer_specified_size = "double"
                 
                 # If customer specified a size, only match that size
@@ -452,78 +461,30 @@ def parse_order_items(order_text):
                     logger.info(f"Skipping '{item}' - customer specified '{customer_specified_size}' but item is '{item_lower}'")
                     continue
             
-            # Also try with "w/" replaced with "with" for matching
-            base_name_with = base_name.replace("w/", "with")
-            
-            # Also try with spaces around "w/" normalized
-            base_name_normalized = item_lower
-            for variation in [" small", " double", " large", " medium", " solo", " w/ rice", " with rice"]:
-                base_name_normalized = base_name_normalized.replace(variation, "")
-            # Replace "w/" with "with" but keep the space structure
-            base_name_normalized = base_name_normalized.replace(" w/", " with")
-            
-            # Try all versions for matching
-            match_found = False
-            for test_name in [base_name, base_name_with, base_name_normalized]:
-                if test_name in text_lower:
-                    # Check if this is a valid match (not a substring within another word)
-                    item_position = text_lower.find(test_name)
-                    
-                    # Check if the match is a complete word (not part of another word)
-                    is_valid_match = True
-                    
-                    # Check character before the match
-                    if item_position > 0:
-                        char_before = text_lower[item_position - 1]
-                        if char_before.isalnum():
-                            is_valid_match = False
-                    
-                    # Check character after the match
-                    if item_position + len(test_name) < len(text_lower):
-                        char_after = text_lower[item_position + len(test_name)]
-                        if char_after.isalnum():
-                            is_valid_match = False
-                    
-                    if is_valid_match:
-                        match_found = True
-                        break
+            # Try the base name, the "with" spelling and the normalized form
+            test_names = entry["test_names"]
+            match_found = any(test_name in text and text.is_word_at(text.find(test_name), len(test_name))
+                              for test_name in test_names)
             
             if match_found:
+                # Position of the first form present in the text, for context and quantity
+                test_name = next((name for name in test_names if name in text), test_names[-1])
+                item_position = text.find(test_name)
+                
                 # Check if we already found a match for this base item (avoid duplicates)
                 base_already_found = False
                 existing_item_to_replace = None
+                current_base = strip_variations(base_name)
                 
                 for i, parsed_item in enumerate(parsed_items):
-                    # Extract the item name from the parsed item
                     found_item_name = parsed_item["name"].lower()
                     
-                    # Check if this is the same base item by comparing the core item name
-                    # Remove size variations from both items and compare
-                    found_base = found_item_name
-                    for variation in [" small", " double", " large", " medium", " solo", " w/ rice", " w/", " with rice", " with"]:
-                        found_base = found_base.replace(variation, "")
-                    
-                    current_base = base_name
-                    for variation in [" small", " double", " large", " medium", " solo", " w/ rice", " w/", " with rice", " with"]:
-                        current_base = current_base.replace(variation, "")
-                    
-                    # Check if the base items are the same
-                    if current_base == found_base:
+                    # Same base item once size variations are removed from both
+                    if current_base == compiled.base_of(parsed_item["name"]):
                         # Check if the current item has a customer-specified variation near this item
                         customer_specified_variation = None
-                        # Find the position of the matched text for context
-                        item_position = -1
-                        for test_name in [base_name, base_name_with, base_name_normalized]:
-                            if test_name in text_lower:
-                                item_position = text_lower.find(test_name)
-                                break
-                        
                         if item_position >= 0:
-                            item_context = text_lower[max(0, item_position-20):item_position+len(test_name)+20]
-                            for variation in ["small", "double", "large", "medium", "solo"]:
-                                if variation in item_context:
-                                    customer_specified_variation = variation
-                                    break
+                            customer_specified_variation = text.context_size(item_position, len(test_name))
                         
                         # If customer specified a variation, prioritize that over the existing match
                         if customer_specified_variation and customer_specified_variation in item_lower:
@@ -536,150 +497,59 @@ def parse_order_items(order_text):
                             break
                 
                 if not base_already_found:
-                    # Find the actual position of the matched text for quantity extraction
-                    item_position = -1
-                    for test_name in [base_name, base_name_with, base_name_normalized]:
-                        if test_name in text_lower:
-                            item_position = text_lower.find(test_name)
-                            break
-                    
-                    # Try to extract quantity for this specific item
-                    quantity = 1
-                    
-                    # Look for quantity words near this item
-                    item_context = text_lower[max(0, item_position-20):item_position+len(test_name)+20]
-                    
-                    for qty_word in ["1", "2", "3", "4", "5", "one", "two", "three", "four", "five"]:
-                        if qty_word in item_context:
-                            if qty_word.isdigit():
-                                quantity = int(qty_word)
-                            elif qty_word == "two":
-                                quantity = 2
-                            elif qty_word == "three":
-                                quantity = 3
-                            elif qty_word == "four":
-                                quantity = 4
-                            elif qty_word == "five":
-                                quantity = 5
-                            break
-                    
                     parsed_items.append({
                         "name": item,
-                        "quantity": quantity,
+                        "quantity": 1,
                         "price": price,
-                        "total": quantity * price
+                        "total": price
                     })
-                    logger.info(f"Found item '{item}' (base: '{base_name}') with quantity {quantity} at ₱{price} each = ₱{quantity * price}")
+                    spans.append((item_position, item_position + len(test_name)))
+                    logger.info(f"Found item '{item}' (base: '{base_name}') at ₱{price} each")
                 elif existing_item_to_replace is not None:
                     # Replace the existing item with the customer-specified variation
                     old_item = parsed_items[existing_item_to_replace]
                     
-                    # Find the actual position of the matched text for quantity extraction
-                    item_position = -1
-                    for test_name in [base_name, base_name_with, base_name_normalized]:
-                        if test_name in text_lower:
-                            item_position = text_lower.find(test_name)
-                            break
-                    
-                    # Try to extract quantity for this specific item
-                    quantity = 1
-                    
-                    # Look for quantity words near this item
-                    item_context = text_lower[max(0, item_position-20):item_position+len(test_name)+20]
-                    
-                    for qty_word in ["1", "2", "3", "4", "5", "one", "two", "three", "four", "five"]:
-                        if qty_word in item_context:
-                            if qty_word.isdigit():
-                                quantity = int(qty_word)
-                            elif qty_word == "two":
-                                quantity = 2
-                            elif qty_word == "three":
-                                quantity = 3
-                            elif qty_word == "four":
-                                quantity = 4
-                            elif qty_word == "five":
-                                quantity = 5
-                            break
-                    
                     parsed_items[existing_item_to_replace] = {
                         "name": item,
-                        "quantity": quantity,
+                        "quantity": 1,
                         "price": price,
-                        "total": quantity * price
+                        "total": price
                     }
-                    logger.info(f"Replaced '{old_item['name']}' with '{item}' (base: '{base_name}') with quantity {quantity} at ₱{price} each = ₱{quantity * price}")
+                    spans[existing_item_to_replace] = (item_position, item_position + len(test_name))
+                    logger.info(f"Replaced '{old_item['name']}' with '{item}' (base: '{base_name}') at ₱{price} each")
                 else:
                     logger.info(f"Skipping '{item}' - base item already found")
     
-    # If no exact matches found, try to find base item without size variations
+    # If no exact matches found, try to find base item without size variations - find ALL base items
     if not parsed_items:
         logger.info("No exact matches found, trying base item matching...")
         
-        # Extract base item names (remove size variations)
-        base_items = {}
-        for item, price in all_pricing.items():
-            base_name = item.lower()
-            # Remove size variations
-            for variation in [" small", " double", " large", " medium", " solo"]:
-                base_name = base_name.replace(variation, "")
-            
-            # Store the lowest price for each base item
-            if base_name not in base_items or price < base_items[base_name]:
-                base_items[base_name] = price
-        
-        # Check if any base item matches the order text - find ALL base items
-        for base_item, price in base_items.items():
-            if base_item in text_lower:
-                # Check if this is a valid match (not a substring within another word)
-                item_position = text_lower.find(base_item)
+        for base_item, price in compiled.base_items.items():
+            if base_item in text:
+                item_position = text.find(base_item)
                 
-                # Check if the match is a complete word (not part of another word)
-                is_valid_match = True
-                
-                # Check character before the match
-                if item_position > 0:
-                    char_before = text_lower[item_position - 1]
-                    if char_before.isalnum():
-                        is_valid_match = False
-                
-                # Check character after the match
-                if item_position + len(base_item) < len(text_lower):
-                    char_after = text_lower[item_position + len(base_item)]
-                    if char_after.isalnum():
-                        is_valid_match = False
-                
-                # Skip if not a valid word match
-                if not is_valid_match:
+                # Skip if not a valid word match (not a substring within another word)
+                if not text.is_word_at(item_position, len(base_item)):
                     logger.info(f"Skipping base item '{base_item}' - found as substring in another word")
                     continue
                 
-                quantity = 1
-                
-                # Look for quantity words near this base item
-                item_context = text_lower[max(0, item_position-20):item_position+len(base_item)+20]
-                
-                for qty_word in ["1", "2", "3", "4", "5", "one", "two", "three", "four", "five"]:
-                    if qty_word in item_context:
-                        if qty_word.isdigit():
-                            quantity = int(qty_word)
-                        elif qty_word == "two":
-                            quantity = 2
-                        elif qty_word == "three":
-                            quantity = 3
-                        elif qty_word == "four":
-                            quantity = 4
-                        elif qty_word == "five":
-                            quantity = 5
-                        break
-                
                 parsed_items.append({
                     "name": base_item,
-                    "quantity": quantity,
+                    "quantity": 1,
                     "price": price,
-                    "total": quantity * price
+                    "total": price
                 })
-                logger.info(f"Found base item '{base_item}' with quantity {quantity} at ₱{price} each = ₱{quantity * price}")
-                # Continue to find more base items instead of breaking
+                spans.append((item_position, item_position + len(base_item)))
+                logger.info(f"Found base item '{base_item}' at ₱{price} each")
+    
+    # Quantities bind once every item and its position is known; other menu
+    # mentions (longest first, whole words) keep their own quantities
+    mention_spans = []
+    for start, end in sorted(((start, start + len(pattern)) for pattern, starts in text.occurrences.items() if pattern in mentions
+                              for start in starts if text.is_word_at(start, len(pattern))), key=lambda span: (span[0], -span[1])):
+        if not mention_spans or start >= mention_spans[-1][1]:
+            mention_spans.append((start, end))
+    bind_quantities(text.text, parsed_items, spans, mention_spans)
     
     if parsed_items:
         total = sum(item["total"] for item in parsed_items)
@@ -694,288 +564,680 @@ def parse_order_items(order_text):
     
     return parsed_items
 
-def calculate_order_total(order_text):
-    """Calculate estimated total for Facebook orders based on menu items"""
-    parsed_items = parse_order_items(order_text)
-    return sum(item["total"] for item in parsed_items)
+# Order analysis
+# validate_order_text, detect_item_variations, get_complete_menu_name,
+# parse_order_items and calculate_order_total are all views of one OrderAnalysis.
+# An order is lowercased, cleaned and scanned once (one automaton over the
+# lowercase text, one over the cleaned text) and the result is memoized per
+# normalized text until menu_config, pricing_config or category_menu changes.
+ORDER_ANALYSIS_CACHE_SIZE = 512
+QUESTION_WORDS = ['what', 'how', 'when', 'where', 'why', 'can', 'could', 'would', 'should', 'is', 'are', 'do', 'does']
 
-def validate_order_text(text):
-    """Check if the text contains valid menu items"""
-    load_menu_config()
-    
-    if not menu_config or not menu_config.get("menu_items"):
-        # If no menu config, allow all orders (fallback)
-        return True, "Order accepted (no menu validation)"
-    
-    text_lower = text.lower().strip()
-    
-    # Get all menu items from all categories (excluding free requests)
-    all_menu_items = []
-    for category, items in menu_config.get("menu_items", {}).items():
-        if category not in ['free_requests']:  # Exclude free requests from main validation
-            all_menu_items.extend(items)
-    
-    # Also include chargeable extras
-    chargeable_extras = menu_config.get("menu_items", {}).get("chargeable_extras", [])
-    all_menu_items.extend(chargeable_extras)
-    
-    # Check if any menu item is mentioned in the text
-    found_items = []
-    match_scores = {}  # Track match quality for prioritization
-    
-    for item in all_menu_items:
+def clean_order_text(text_lower):
+    return text_lower.replace(' w/', ' ').replace(' with ', ' ').replace(' & ', ' and ')
+
+# Typo tolerance
+# Misspelled menu words ("brocoli") and run-together names ("kungpao") are
+# corrected before an order is scanned. The menu and pricing vocabulary is
+# indexed SymSpell-style: each term is stored under every string left after
+# deleting up to FUZZY_MAX_EDIT_DISTANCE characters, so a lookup only generates
+# the deletes of the typed word, whatever the size of the menu.
+FUZZY_MAX_EDIT_DISTANCE = 2
+FUZZY_MIN_CONFIDENCE = 0.8  # 1 - edits / word length
+FUZZY_MIN_WORD_LENGTH = 6  # shorter words are never corrected
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+def edit_distance(source, target):
+    """Damerau-Levenshtein distance (optimal string alignment)"""
+    before_previous, previous = None, list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        current = [i] + [0] * len(target)
+        for j in range(1, len(target) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (source[i - 1] != target[j - 1]))
+            if i > 1 and j > 1 and source[i - 1] == target[j - 2] and source[i - 2] == target[j - 1]:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        before_previous, previous = previous, current
+    return previous[-1]
+
+class FuzzyMatcher:
+    """Symmetric-delete spelling index over menu words and joined word pairs"""
+    def __init__(self, names, ignored=(), max_distance=FUZZY_MAX_EDIT_DISTANCE, min_confidence=FUZZY_MIN_CONFIDENCE):
+        self.max_distance = max_distance
+        self.min_confidence = min_confidence
+        self.ignored = set(ignored)
+        # term -> [replacement, frequency]; "kungpao" -> "kung pao"
+        self.terms = {}
+        split_names = [WORD_PATTERN.findall(name.lower()) for name in names]
+        for words in split_names:
+            for word in words:
+                self.terms.setdefault(word, [word, 0])[1] += 1
+        for words in split_names:
+            for first, second in zip(words, words[1:]):
+                self.terms.setdefault(first + second, [f"{first} {second}", 0])[1] += 1
+        self.deletes = {}
+        for term in self.terms:
+            for variant in self.variants(term, max_distance):
+                self.deletes.setdefault(variant, set()).add(term)
+
+    @staticmethod
+    def variants(word, distance):
+        """word and every string left after deleting up to `distance` characters"""
+        found = edge = {word}
+        for _ in range(distance):
+            edge = {variant[:i] + variant[i + 1:] for variant in edge for i in range(len(variant))}
+            found = found | edge
+        return found
+
+    def lookup(self, word):
+        """(replacement, edits, confidence) for a typed word, or None"""
+        if word in self.terms:
+            return self.terms[word][0], 0, 1.0
+        # One edit from 6 letters, two from 8
+        limit = min(self.max_distance, len(word) // 4)
+        if len(word) < FUZZY_MIN_WORD_LENGTH or not limit:
+            return None
+        best = None
+        for variant in self.variants(word, limit):
+            for term in self.deletes.get(variant, ()):
+                if abs(len(term) - len(word)) > limit:
+                    continue
+                distance = edit_distance(word, term)
+                if distance <= limit:
+                    # Fewest edits, then the most common menu word
+                    rank = (distance, -self.terms[term][1], term)
+                    if best is None or rank < best:
+                        best = rank
+        if best is None:
+            return None
+        confidence = 1 - best[0] / len(word)
+        if confidence < self.min_confidence:
+            return None
+        return self.terms[best[2]][0], best[0], confidence
+
+    def correct(self, text):
+        """(corrected text, [(typed, replacement, confidence)]) for a lowercase text"""
+        corrections = []
+        def replace(match):
+            word = match.group()
+            if word in self.ignored:
+                return word
+            found = self.lookup(word)
+            if found is None or found[0] == word:
+                return word
+            corrections.append((word, found[0], round(found[2], 2)))
+            return found[0]
+        return WORD_PATTERN.sub(replace, text), corrections
+
+class MenuMatcher:
+    """menu_config vocabulary for validation, menu names and variation prompts, compiled once"""
+    def __init__(self, menu):
+        menu_items = menu.get("menu_items", {}) if menu else {}
+        self.configured = bool(menu and menu_items)
+        
+        # Validation covers everything except free requests (chargeable extras are listed twice)
+        validation_names = [item for category, items in menu_items.items() if category not in ['free_requests'] for item in items]
+        validation_names.extend(menu_items.get("chargeable_extras", []))
+        self.validation_items = [self.describe(item) for item in validation_names]
+        self.validation_triggers = self.index_triggers(self.validation_items)
+        
+        # Complete menu names prefer longer, more specific items
+        all_names = [item for items in menu_items.values() for item in items]
+        self.name_items = [self.describe(item) for item in sorted(all_names, key=len, reverse=True)]
+        self.name_triggers = self.index_triggers(self.name_items)
+        
+        # Menu names that can carry a quantity even when they have no price
+        self.mentions = {entry["lower"] for entry in self.validation_items + self.name_items}
+        
+        self.patterns = list(QUESTION_WORDS)
+        self.clean_patterns = []
+        for entry in self.validation_items + self.name_items:
+            self.patterns.append(entry["lower"])
+            self.clean_patterns.append(entry["clean"])
+            self.clean_patterns.extend(entry["words"])
+
+    @staticmethod
+    def describe(item):
         item_lower = item.lower()
-        text_lower = text.lower().strip()
+        item_clean = clean_order_text(item_lower)
+        return {"name": item, "lower": item_lower, "clean": item_clean, "words": [word for word in item_clean.split() if len(word) > 2]}
+
+    @staticmethod
+    def index_triggers(entries):
+        """Map each pattern to the entries it can make match: full name, cleaned name or any key word"""
+        lower_triggers, clean_triggers = {}, {}
+        for index, entry in enumerate(entries):
+            lower_triggers.setdefault(entry["lower"], set()).add(index)
+            for pattern in [entry["clean"]] + entry["words"]:
+                clean_triggers.setdefault(pattern, set()).add(index)
+        return lower_triggers, clean_triggers
+
+    @staticmethod
+    def candidates(triggers, lower, clean):
+        lower_triggers, clean_triggers = triggers
+        found = set()
+        for pattern in lower.occurrences:
+            found.update(lower_triggers.get(pattern, ()))
+        for pattern in clean.occurrences:
+            found.update(clean_triggers.get(pattern, ()))
+        return sorted(found)
+
+    def valid_items(self, lower, clean, text_words):
+        """Menu items mentioned in the text, best matches first"""
+        found_items = []
+        match_scores = {}  # Track match quality for prioritization
         
-        # Direct match (highest priority)
-        if item_lower in text_lower:
-            found_items.append(item)
-            match_scores[item] = 100  # Perfect match
-            continue
+        for index in self.candidates(self.validation_triggers, lower, clean):
+            entry = self.validation_items[index]
+            item = entry["name"]
             
-        # Flexible matching for common variations
-        # Remove common separators and check for partial matches
-        item_clean = item_lower.replace(' w/', ' ').replace(' with ', ' ').replace(' & ', ' and ')
-        text_clean = text_lower.replace(' w/', ' ').replace(' with ', ' ').replace(' & ', ' and ')
-        
-        if item_clean in text_clean:
-            found_items.append(item)
-            match_scores[item] = 90  # Very good match
-            continue
+            # Direct match (highest priority)
+            if entry["lower"] in lower:
+                found_items.append(item)
+                match_scores[item] = 100  # Perfect match
+                continue
             
-        # Check if all key words from item are in text
-        item_words = [word for word in item_clean.split() if len(word) > 2]  # Skip short words
-        if len(item_words) >= 2 and all(word in text_clean for word in item_words):
-            found_items.append(item)
-            match_scores[item] = 80  # Good match
-            continue
+            # Flexible matching for common variations
+            if entry["clean"] in clean:
+                found_items.append(item)
+                match_scores[item] = 90  # Very good match
+                continue
             
-        # Check for partial matches (at least 2 significant words match)
-        text_words = [word for word in text_clean.split() if len(word) > 2]
-        matching_words = [word for word in item_words if word in text_words]
-        if len(matching_words) >= 2:
-            found_items.append(item)
-            match_scores[item] = 70  # Partial match
-    
-    if found_items:
+            # Check if all key words from item are in text
+            item_words = entry["words"]
+            if len(item_words) >= 2 and all(word in clean for word in item_words):
+                found_items.append(item)
+                match_scores[item] = 80  # Good match
+                continue
+            
+            # Check for partial matches (at least 2 significant words match)
+            matching_words = [word for word in item_words if word in text_words]
+            if len(matching_words) >= 2:
+                found_items.append(item)
+                match_scores[item] = 70  # Partial match
+        
         # Sort by match score (highest first) to prioritize better matches
         sorted_items = sorted(found_items, key=lambda x: match_scores.get(x, 0), reverse=True)
         
         # For ambiguous cases (like "lechon kawali"), prefer more specific matches
         best_matches = []
         for item in sorted_items:
-            # If we have multiple matches, prefer the most specific one
             if len(best_matches) == 0 or match_scores[item] >= match_scores[best_matches[0]]:
                 best_matches.append(item)
             elif match_scores[item] < match_scores[best_matches[0]] - 10:  # Significant difference
                 break
+        return best_matches
+
+    def complete_menu_name(self, lower, clean, text_words):
+        """Best matching menu item name, or None"""
+        best_match = None
+        best_score = 0
         
-        return True, f"Valid order containing: {', '.join(best_matches)}"
-    
-    # Check if it looks like a question or non-order
-    question_words = ['what', 'how', 'when', 'where', 'why', 'can', 'could', 'would', 'should', 'is', 'are', 'do', 'does']
-    if any(word in text_lower for word in question_words) and len(text) < 50:
-        return False, "This appears to be a question, not an order"
-    
-    # If no menu items found and doesn't look like a question, ask for clarification
-    return False, "I don't recognize any menu items in your message. Please check our menu and try again."
+        for index in self.candidates(self.name_triggers, lower, clean):
+            entry = self.name_items[index]
+            
+            # Direct or flexible match (highest priority)
+            if entry["lower"] in lower or entry["clean"] in clean:
+                return entry["name"]
+            
+            # Word-based matching
+            matching_words = [word for word in entry["words"] if word in text_words]
+            if len(matching_words) >= 2 and len(matching_words) > best_score:
+                best_match = entry["name"]
+                best_score = len(matching_words)
+        
+        return best_match
+
+VARIATION_WINDOW = 12  # characters between a base item and the variation that settles it
+
+class VariationResolver:
+    """Base items that need a choice before they can be priced, compiled from category_menu.json"""
+    def __init__(self, categories, priced_names, speller, menu_names=()):
+        priced = {name.lower() for name in priced_names}
+        # base -> {variation: priced item name}, only for choices pricing_config can charge for
+        self.choices = {}
+        for items in self.item_groups(categories.get("menu_categories", {}).values()):
+            # Menu names are spelled the way customer text is after correction ("periperi" -> "peri peri")
+            names = [speller.correct(item["name"].lower())[0] for item in items]
+            for name, item in zip(names, items):
+                variations = item.get("variations", [])
+                if len(variations) > 1:
+                    self.add(name, [variation["name"].lower() for variation in variations], priced)
+            # Single-variation items sharing a base before " w/ " are one base with a choice of add-on
+            add_ons = {}
+            for name in names:
+                if " w/ " in name:
+                    base, add_on = name.split(" w/ ", 1)
+                    add_ons.setdefault(base, []).append(f"w/ {add_on}")
+            for base, variations in add_ons.items():
+                if len(variations) > 1:
+                    self.add(base, variations, priced)
+        # Spellings found in text -> base or (base, variation)
+        self.base_spellings = {}
+        self.variation_spellings = {}
+        for base, choices in self.choices.items():
+            for spelling in self.spellings(base):
+                self.base_spellings[spelling] = base
+            for variation in choices:
+                for spelling in self.spellings(variation):
+                    self.variation_spellings.setdefault(spelling, []).append((base, variation))
+                    if variation.startswith("w/ "):
+                        self.variation_spellings.setdefault(spelling[3:], []).append((base, variation))
+        # Customers type menu_config aliases ("kung pao", "broccoli") and swapped
+        # two-word names ("broccoli beef"); each maps to the one base whose words
+        # contain it. Other menu names (e.g. "yangchow fried rice") block the base
+        # mentions inside them.
+        self.block_spellings = set()
+        for base in self.choices:
+            words = base.split()
+            if len(words) == 2:
+                self.base_spellings.setdefault(f"{words[1]} {words[0]}", base)
+        for name in menu_names:
+            name = speller.correct(name.lower())[0]
+            if name in self.base_spellings:
+                continue
+            base = self.alias_base(name)
+            if base is None:
+                self.block_spellings.add(name)
+            elif not set(self.name_words(name)) & self.variation_words(base):
+                self.base_spellings[name] = base
+        self.patterns = list(self.base_spellings) + list(self.variation_spellings) + list(self.block_spellings)
+
+    @staticmethod
+    def name_words(name):
+        return [word for word in WORD_PATTERN.findall(name) if word not in ("w", "with", "and")]
+
+    def variation_words(self, base):
+        return {word for variation in self.choices[base] for word in self.name_words(variation)} - set(self.name_words(base))
+
+    def alias_base(self, name):
+        """The only base whose words include all of name's words (plus any of its variation words), or None"""
+        words = set(self.name_words(name))
+        if not words:
+            return None
+        found = [base for base in self.choices if words <= set(self.name_words(base)) | self.variation_words(base)]
+        return found[0] if len(found) == 1 else None
+
+    @classmethod
+    def item_groups(cls, categories):
+        """Items of each category and subcategory"""
+        for category in categories:
+            if category.get("items"):
+                yield category["items"]
+            yield from cls.item_groups(category.get("subcategories", {}).values())
+
+    def add(self, base, variations, priced):
+        choices = {}
+        for variation in variations:
+            for name in (f"{base} {variation}", f"{variation} {base}"):
+                if name in priced:
+                    choices[variation] = name
+                    break
+        if len(choices) > 1:
+            self.choices[base] = choices
+
+    @staticmethod
+    def spellings(name):
+        return {name, name.replace("w/ ", "with "), name.replace(" & ", " and "), name.replace("w/ ", "with ").replace(" & ", " and ")}
+
+    def unresolved(self, lower):
+        """Base items in the scanned text with none of their variations next to them, in text order"""
+        # Whole-word base mentions; one inside a longer mention is part of it,
+        # and one inside a longer variation or other menu name is not a base at all
+        spans, covers = [], []
+        for pattern, starts in lower.occurrences.items():
+            for start in starts:
+                if not lower.is_word_at(start, len(pattern)):
+                    continue
+                if pattern in self.base_spellings:
+                    spans.append((start, start + len(pattern), self.base_spellings[pattern]))
+                if pattern in self.variation_spellings or pattern in self.block_spellings:
+                    covers.append((start, start + len(pattern)))
+        mentions = []
+        for start, end, base in sorted(spans, key=lambda span: (span[0], -span[1])):
+            if any(cover_start <= start and end <= cover_end and cover_end - cover_start > end - start for cover_start, cover_end in covers):
+                continue
+            if not mentions or start >= mentions[-1][1]:
+                mentions.append((start, end, base))
+        # Each variation settles the nearest mention of a base that offers it, the preceding one on a tie
+        resolved = set()
+        for pattern, starts in lower.occurrences.items():
+            offered = self.variation_spellings.get(pattern)
+            if not offered:
+                continue
+            bases = {base for base, _ in offered}
+            for start in starts:
+                if not lower.is_word_at(start, len(pattern)):
+                    continue
+                best = None
+                for index, (base_start, base_end, base) in enumerate(mentions):
+                    if base not in bases:
+                        continue
+                    follows = base_start >= start + len(pattern)
+                    gap = base_start - start - len(pattern) if follows else start - base_end
+                    if 0 <= gap <= VARIATION_WINDOW and (best is None or (gap, follows) < best[0]):
+                        best = ((gap, follows), index)
+                if best:
+                    resolved.add(best[1])
+        return [{"base_item": base, "variations": list(self.choices[base]), "choices": self.choices[base],
+                 "mention": lower.text[start:end], "start": start, "end": end}
+                for index, (start, end, base) in enumerate(mentions) if index not in resolved]
+
+class OrderAnalysis:
+    """Everything the order flow needs to know about one order text"""
+    def __init__(self, text, corrections, menu_checked, valid_items, question, variations_needed, complete_menu_name, parsed_items):
+        self.text = text
+        self.corrections = corrections
+        # Lowest confidence of any spelling correction, 1.0 when the text was used as typed
+        self.confidence = min((confidence for _, _, confidence in corrections), default=1.0)
+        self.menu_checked = menu_checked
+        self.valid_items = valid_items
+        self.question = question
+        self.variations_needed = variations_needed
+        self.complete_menu_name = complete_menu_name
+        self.parsed_items = parsed_items
+        self.total = sum(item["total"] for item in parsed_items)
+
+    def validation(self, text):
+        """(is_valid, message) for the original text"""
+        if not self.menu_checked:
+            # If no menu config, allow all orders (fallback)
+            return True, "Order accepted (no menu validation)"
+        if self.valid_items:
+            return True, f"Valid order containing: {', '.join(self.valid_items)}"
+        
+        # Check if it looks like a question or non-order
+        if self.question and len(text) < 50:
+            return False, "This appears to be a question, not an order"
+        
+        # If no menu items found and doesn't look like a question, ask for clarification
+        return False, "I don't recognize any menu items in your message. Please check our menu and try again."
+
+class OrderAnalyzer:
+    def __init__(self, menu, pricing, categories):
+        self.menu = MenuMatcher(menu)
+        self.pricing = PricingMatcher(pricing)
+        menu_items = menu.get("menu_items", {}) if menu else {}
+        vocabulary = [item for items in menu_items.values() for item in items] + list(self.pricing.all_pricing)
+        # Words customers use around orders are left alone even if they resemble a menu word
+        ignored = set(QUESTION_WORDS) | set(QUANTITY_WORDS) | set(SIZE_WORDS)
+        for phrase in (menu or {}).get("order_keywords", []) + (menu or {}).get("quantities", []):
+            ignored.update(WORD_PATTERN.findall(phrase))
+        self.speller = FuzzyMatcher(vocabulary, ignored)
+        menu_names = [item for category, items in menu_items.items() if category != "free_requests" for item in items]
+        self.variations = VariationResolver(categories, self.pricing.all_pricing, self.speller, menu_names)
+        self.lower_matcher = PatternMatcher(self.pricing.patterns + self.menu.patterns + self.variations.patterns)
+        self.clean_matcher = PatternMatcher(self.menu.clean_patterns)
+
+    def analyze(self, order_text):
+        text_lower, corrections = self.speller.correct(order_text.lower().strip())
+        if corrections:
+            logger.info(f"Spelling corrections: {', '.join(f'{typed} -> {word} ({confidence})' for typed, word, confidence in corrections)}")
+        lower = self.lower_matcher.scan(text_lower)
+        text_clean = clean_order_text(text_lower)
+        clean = self.clean_matcher.scan(text_clean)
+        text_words = {word for word in text_clean.split() if len(word) > 2}
+        menu = self.menu
+        return OrderAnalysis(
+            text=text_lower,
+            corrections=corrections,
+            menu_checked=menu.configured,
+            valid_items=menu.valid_items(lower, clean, text_words) if menu.configured else [],
+            question=any(word in lower for word in QUESTION_WORDS),
+            variations_needed=self.variations.unresolved(lower) if menu.configured else [],
+            complete_menu_name=menu.complete_menu_name(lower, clean, text_words) if menu.configured else None,
+            parsed_items=parse_items(self.pricing, lower, order_text, self.menu.mentions)
+        )
+
+order_analyzer = {"menu_config": None, "pricing_config": None, "category_menu": None, "analyzer": None, "cache": OrderedDict()}
+
+def get_order_analyzer():
+    load_menu_config()
+    load_pricing_config()
+    load_category_menu()
+    if (order_analyzer["menu_config"] is not menu_config or order_analyzer["pricing_config"] is not pricing_config
+            or order_analyzer["category_menu"] is not category_menu):
+        order_analyzer.update(menu_config=menu_config, pricing_config=pricing_config, category_menu=category_menu,
+                              analyzer=OrderAnalyzer(menu_config, pricing_config, category_menu), cache=OrderedDict())
+    return order_analyzer["analyzer"]
+
+def analyze_order(order_text):
+    """Memoized OrderAnalysis for order_text (keyed by its lowercased, stripped form)"""
+    analyzer = get_order_analyzer()
+    cache = order_analyzer["cache"]
+    key = order_text.lower().strip()
+    analysis = cache.get(key)
+    if analysis is None:
+        analysis = cache[key] = analyzer.analyze(order_text)
+        if len(cache) > ORDER_ANALYSIS_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+    return analysis
+
+def calculate_order_total(order_text):
+    """Calculate estimated total for Facebook orders based on menu items"""
+    return analyze_order(order_text).total
+
+def validate_order_text(text):
+    """Check if the text contains valid menu items"""
+    return analyze_order(text).validation(text)
 
 # User states
 user_states = {}
 last_greeted = {}
 menu_shown_time = {}
 user_menu_muted_until = {}
+variation_sessions = {}  # psid -> VariationSession
 
 # Variation detection and prompting
 def detect_item_variations(order_text):
     """Detect ALL items that need variation selection in multi-item orders"""
-    load_menu_config()
-    
-    if not menu_config or not menu_config.get("menu_items"):
-        return []
-    
-    text_lower = order_text.lower().strip()
-    items_needing_variations = []
-    
-    # Define base items and their variations based on menu categories
-    base_items = {}
-    
-    # Stir fry items (small/double) - matching pricing config
-    stir_fry_items = menu_config.get("menu_items", {}).get("stir_fry", [])
-    for item in stir_fry_items:
-        # Extract base item name (remove common variations)
-        base_name = item
-        for variation in [" small", " double", " large", " medium", " solo"]:
-            base_name = base_name.replace(variation, "")
-        base_items[base_name] = ["small", "double"]
-    
-    # Add specific base items for items that might be detected as shorter versions
-    # This ensures "chicken w/ mushroom" is detected properly, not just "mushroom"
-    specific_base_items = {
-        "chicken w/ mushroom": ["small", "double"],
-        "chicken with mushroom": ["small", "double"]
-    }
-    base_items.update(specific_base_items)
-    
-    # Short order items (solo/large) - matching pricing config
-    short_order_items = menu_config.get("menu_items", {}).get("short_order", [])
-    for item in short_order_items:
-        # Extract base item name
-        base_name = item
-        for variation in [" solo", " large"]:  # Only solo and large, no medium
-            base_name = base_name.replace(variation, "")
-        base_items[base_name] = ["solo", "large"]
-    
-    # Yangchow special items
-    yangchow_items = menu_config.get("menu_items", {}).get("yangchow", [])
-    for item in yangchow_items:
-        if "yangchow" in item.lower() and not any(specific in item.lower() for specific in ["pork tonkatsu", "sweet", "chicken fillet", "general tso", "lechon"]):
-            base_items["yangchow"] = ["w/ pork tonkatsu", "w/ sweet & sour pork", "w/ chicken fillet", "w/ general tso chicken", "w/ lechon kawali"]
-            break
-    
-    # Check for ALL base items in the order text that need variations
-    # Sort by length (longest first) to prioritize more specific matches
-    sorted_base_items = sorted(base_items.items(), key=lambda x: len(x[0]), reverse=True)
-    
-    for base_item, variations in sorted_base_items:
-        if base_item in text_lower:
-            # Check if variation is already specified
-            variation_specified = False
-            for variation in variations:
-                if variation in text_lower:
-                    variation_specified = True
-                    break
-            
-            # If no variation specified, add to list of items needing variations
-            if not variation_specified:
-                # Check if we already have a similar base item (avoid duplicates)
-                # Since we're processing in length order (longest first), 
-                # we should skip items that are already covered by longer matches
-                is_duplicate = False
-                for existing_item in items_needing_variations:
-                    # If the current base item is contained in an existing one, skip it
-                    if base_item in existing_item["base_item"]:
-                        is_duplicate = True
-                        break
-                
-                if not is_duplicate:
-                    items_needing_variations.append({
-                        "base_item": base_item,
-                        "variations": variations
-                    })
-    
-    return items_needing_variations
+    return [dict(item, variations=list(item["variations"]), choices=dict(item["choices"]))
+            for item in analyze_order(order_text).variations_needed]
+
+VARIATION_CAROUSEL_MAX_ITEMS = 10  # generic template element limit
+VARIATION_CAROUSEL_MAX_BUTTONS = 3  # postback buttons per element
+VARIATION_BUTTON_TITLE_MAX = 20
 
-def ask_for_variation(psid, base_item, variations, is_multi_item=False, current_index=0, total_items=0):
-    """Ask user to select a variation"""
-    if not variations:
+class VariationSession:
+    """An order waiting for size or variation choices, one per unresolved base item"""
+    def __init__(self, order_text, text, items):
+        self.order_text = order_text  # as the customer typed it
+        self.text = text  # corrected lowercase text the item spans refer to
+        self.items = items  # detect_item_variations entries, in text order
+        self.selected = {}  # item index -> variation
+
+    def pending(self):
+        return [index for index in range(len(self.items)) if index not in self.selected]
+
+    def select(self, index, variation):
+        if 0 <= index < len(self.items) and variation in self.items[index]["choices"]:
+            self.selected[index] = variation
+            return True
         return False
-    
-    # Create quick reply buttons for variations
-    quick_replies = []
-    for variation in variations:
-        quick_replies.append({
-            "content_type": "text",
-            "title": variation.title(),
-            "payload": f"VARIATION_{base_item}_{variation}"
+
+    def select_all(self, variation):
+        """Apply one variation to every pending item that offers it"""
+        return sum(self.select(index, variation) for index in self.pending())
+
+    def shared_variations(self):
+        """Variations offered by more than one pending item, for "All ..." replies"""
+        counts = {}
+        for index in self.pending():
+            for variation in self.items[index]["variations"]:
+                counts[variation] = counts.get(variation, 0) + 1
+        return [variation for variation, count in counts.items() if count > 1]
+
+    @staticmethod
+    def find_variation(item, part):
+        """Variation named in a reply part (longest spelling first) or picked by its number"""
+        for variation in sorted(item["variations"], key=len, reverse=True):
+            if any(spelling in part for spelling in VariationResolver.spellings(variation) | {variation[3:] if variation.startswith("w/ ") else variation}):
+                return variation
+        numbers = re.findall(r"\b\d+\b", part)
+        if len(numbers) == 1 and 1 <= int(numbers[0]) <= len(item["variations"]):
+            return item["variations"][int(numbers[0]) - 1]
+        return None
+
+    def named_items(self, part, pending):
+        """Pending items a reply part names, by full name or else by words only one of them has; None if unclear"""
+        named = [index for index in pending if self.items[index]["mention"] in part or self.items[index]["base_item"] in part]
+        if named:
+            return named
+        choice_words = {word for index in pending for variation in self.items[index]["variations"] for word in VariationResolver.name_words(variation)}
+        item_words = {index: set(VariationResolver.name_words(self.items[index]["mention"] + " " + self.items[index]["base_item"])) - choice_words
+                      for index in pending}
+        hits = [[index for index in pending if word in item_words[index]] for word in VariationResolver.name_words(part)]
+        hits = [found for found in hits if found]
+        # "kung pao double" names kung pao chicken; "chicken double" could be any chicken dish
+        unique = {found[0] for found in hits if len(found) == 1}
+        if len(unique) > 1 or (hits and not unique):
+            return None
+        return list(unique)
+
+    def read_reply(self, text):
+        """Apply a typed reply ("double", "all small", "small, large", "1 2", "chami large"); returns choices made"""
+        text = text.lower().strip()
+        pending = self.pending()
+        if not pending:
+            return 0
+        # "all double", or a single choice when only one item is left
+        if text.startswith("all ") or len(pending) == 1:
+            for index in pending:
+                variation = self.find_variation(self.items[index], text)
+                if variation:
+                    return self.select_all(variation) if text.startswith("all ") else self.select(index, variation)
+            return 0
+        parts = [part.strip() for part in re.split(r"[,;\n]|\band\b", text) if part.strip()]
+        # "1 2" answers the pending items in order by option number
+        if len(parts) == 1 and re.fullmatch(r"\d+(\s+\d+)+", parts[0]):
+            parts = parts[0].split()
+        made = 0
+        for part in parts:
+            pending = self.pending()
+            if not pending:
+                break
+            # A part naming an item answers that item, otherwise the next pending one;
+            # a part that might name more than one item is asked again rather than guessed
+            named = self.named_items(part, pending)
+            if named is None:
+                return made
+            if not named and len(parts) == 1:
+                # One bare choice with several items pending: only if every one of them offers it
+                variations = [self.find_variation(self.items[index], part) for index in pending]
+                if variations[0] and all(variation == variations[0] for variation in variations):
+                    return self.select_all(variations[0])
+                return 0
+            index = named[0] if named else pending[0]
+            variation = self.find_variation(self.items[index], part)
+            if variation:
+                made += self.select(index, variation)
+        return made
+
+    def resolved_text(self):
+        """Order text with each base item replaced by the priced name of its choice"""
+        text = self.text
+        for index in sorted(self.selected, key=lambda index: self.items[index]["start"], reverse=True):
+            item = self.items[index]
+            text = text[:item["start"]] + item["choices"][self.selected[index]] + text[item["end"]:]
+        return text
+
+def variation_quick_replies(session):
+    pending = session.pending()
+    if len(pending) == 1:
+        index = pending[0]
+        quick_replies = [{"content_type": "text", "title": variation.title()[:VARIATION_BUTTON_TITLE_MAX], "payload": f"VARIATION_{index}_{variation}"}
+                         for variation in session.items[index]["variations"]]
+    else:
+        quick_replies = [{"content_type": "text", "title": f"All {variation.title()}"[:VARIATION_BUTTON_TITLE_MAX], "payload": f"VARIATION_ALL_{variation}"}
+                         for variation in session.shared_variations()]
+    quick_replies.append({"content_type": "text", "title": "Cancel", "payload": "VARIATION_CANCEL"})
+    return quick_replies[:13]
+
+def ask_for_variations(psid, session, note=""):
+    """Ask for every pending choice in one message: a carousel when each item fits on a card, else a numbered list"""
+    pending = session.pending()
+    if not pending:
+        return False
+    items = [session.items[index] for index in pending]
+    fits_cards = (1 < len(items) <= VARIATION_CAROUSEL_MAX_ITEMS
+                  and all(len(item["variations"]) <= VARIATION_CAROUSEL_MAX_BUTTONS for item in items)
+                  and all(len(variation) <= VARIATION_BUTTON_TITLE_MAX for item in items for variation in item["variations"]))
+    if fits_cards:
+        # Card subtitles are cut at 80 characters, so the typing hint goes in its own message
+        call_send_api(psid, {"text": f"{note}Tap a choice on each card, or type them all in order (e.g. \"{', '.join(item['variations'][0] for item in items)}\")."})
+        elements = []
+        for position, (index, item) in enumerate(zip(pending, items), 1):
+            elements.append({
+                "title": item["base_item"].title(),
+                "subtitle": f"Item {position} of {len(items)}",
+                "buttons": [{"type": "postback", "title": variation.title(), "payload": f"VARIATION_{index}_{variation}"} for variation in item["variations"]]
+            })
+        return call_send_api(psid, {
+            "attachment": {"type": "template", "payload": {"template_type": "generic", "elements": elements}},
+            "quick_replies": variation_quick_replies(session)
         })
     
-    # Add cancel option
-    quick_replies.append({
-        "content_type": "text",
-        "title": "Cancel",
-        "payload": "VARIATION_CANCEL"
-    })
-    
-    # Determine size type for better messaging
-    if variations == ["small", "double"]:
-        size_type = "size"
-        if is_multi_item:
-            message_text = f"Item {current_index + 1} of {total_items}: I found '{base_item}' in your order. Please choose a size:\n\n"
-        else:
-            message_text = f"I found '{base_item}' in your order. Please choose a size:\n\n"
-    elif variations == ["solo", "medium", "large"]:
-        size_type = "size"
-        if is_multi_item:
-            message_text = f"Item {current_index + 1} of {total_items}: I found '{base_item}' in your order. Please choose a size:\n\n"
-        else:
-            message_text = f"I found '{base_item}' in your order. Please choose a size:\n\n"
-    elif "w/" in variations[0]:
-        size_type = "variation"
-        if is_multi_item:
-            message_text = f"Item {current_index + 1} of {total_items}: I found '{base_item}' in your order. Please choose a variation:\n\n"
-        else:
-            message_text = f"I found '{base_item}' in your order. Please choose a variation:\n\n"
+    if len(items) == 1:
+        item = items[0]
+        message_text = f"{note}I found '{item['base_item']}' in your order. Please choose {'a size' if item['variations'] == ['small', 'double'] else 'an option'}:\n\n"
+        for i, variation in enumerate(item["variations"], 1):
+            message_text += f"{i}. {variation.title()}\n"
     else:
-        size_type = "option"
-        if is_multi_item:
-            message_text = f"Item {current_index + 1} of {total_items}: I found '{base_item}' in your order. Please choose an option:\n\n"
-        else:
-            message_text = f"I found '{base_item}' in your order. Please choose an option:\n\n"
-    
-    for i, variation in enumerate(variations, 1):
-        message_text += f"{i}. {variation.title()}\n"
-    
-    call_send_api(psid, {
-        "text": message_text,
-        "quick_replies": quick_replies
-    })
-    
-    return True
+        message_text = f"{note}A few items in your order need a choice:\n\n"
+        for position, item in enumerate(items, 1):
+            message_text += f"{position}. {item['base_item'].title()}: {' / '.join(variation.title() for variation in item['variations'])}\n"
+        message_text += f"\nReply with your choices in order (e.g. \"{', '.join(item['variations'][0] for item in items)}\")"
+        if session.shared_variations():
+            message_text += " or tap one to apply it to all"
+        message_text += "."
+    return call_send_api(psid, {"text": message_text, "quick_replies": variation_quick_replies(session)})
+
+def start_variation_session(psid, order_text, items_needing_variations):
+    session = VariationSession(order_text, analyze_order(order_text).text, items_needing_variations)
+    variation_sessions[psid] = session
+    user_states[psid] = "awaiting_variation"
+    return ask_for_variations(psid, session)
 
-def process_variation_selection(psid, payload, original_order_text):
-    """Process user's variation selection for multiple items"""
+def end_variation_session(psid):
+    variation_sessions.pop(psid, None)
+    user_states.pop(psid, None)
+
+def process_variation_selection(psid, payload=None, text_message=None):
+    """Apply a tapped (VARIATION_<index>_<variation>, VARIATION_ALL_<variation>) or typed choice"""
+    session = variation_sessions.get(psid)
     if payload == "VARIATION_CANCEL":
-        # Clear all variation states
-        user_states.pop(psid, None)
-        user_states.pop(f"{psid}_original_order", None)
-        user_states.pop(f"{psid}_variation_items", None)
-        user_states.pop(f"{psid}_current_variation_index", None)
-        user_states.pop(f"{psid}_updated_order_text", None)
+        end_variation_session(psid)
         return send_message_with_quick_replies(psid, "Order cancelled. How can I help you today?")
+    if session is None:
+        return send_message_with_quick_replies(psid, "That order is no longer waiting for a choice. How can I help you today?")
     
-    if payload.startswith("VARIATION_"):
-        # Extract base item and variation
+    if payload and payload.startswith("VARIATION_"):
         parts = payload.split("_", 2)
-        if len(parts) >= 3:
-            base_item = parts[1]
-            variation = parts[2]
-            
-            # Get current state
-            variation_items = user_states.get(f"{psid}_variation_items", [])
-            current_index = user_states.get(f"{psid}_current_variation_index", 0)
-            updated_order_text = user_states.get(f"{psid}_updated_order_text", original_order_text)
-            
-            # Update the order text with the selected variation
-            updated_order_text = updated_order_text.replace(base_item, f"{base_item} {variation}")
-            user_states[f"{psid}_updated_order_text"] = updated_order_text
-            
-            # Move to next item that needs variation
-            current_index += 1
-            
-            if current_index < len(variation_items):
-                # Ask for next variation
-                user_states[f"{psid}_current_variation_index"] = current_index
-                current_item = variation_items[current_index]
-                is_multi_item = len(variation_items) > 1
-                
-                call_send_api(psid, {
-                    "text": f"Great! Now for the next item..."
-                })
-                
-                return ask_for_variation(psid, current_item["base_item"], current_item["variations"], 
-                                       is_multi_item=is_multi_item, current_index=current_index, total_items=len(variation_items))
-            else:
-                # All variations selected, process the final order
-                user_states.pop(psid, None)
-                user_states.pop(f"{psid}_original_order", None)
-                user_states.pop(f"{psid}_variation_items", None)
-                user_states.pop(f"{psid}_current_variation_index", None)
-                user_states.pop(f"{psid}_updated_order_text", None)
-                
-                return process_order_with_variation(psid, updated_order_text)
+        if len(parts) < 3:
+            return False
+        if parts[1] == "ALL":
+            made = session.select_all(parts[2])
+        else:
+            made = session.select(int(parts[1]), parts[2]) if parts[1].isdigit() else 0
+    else:
+        made = session.read_reply(text_message or "")
     
-    return False
+    if not session.pending():
+        # All variations selected, process the final order
+        end_variation_session(psid)
+        logger.info(f"Variations chosen for '{session.order_text}': '{session.resolved_text()}'")
+        return process_order_with_variation(psid, session.resolved_text())
+    
+    if not made:
+        return ask_for_variations(psid, session, note="Sorry, I didn't catch that choice.\n\n")
+    if payload and not payload.startswith("VARIATION_ALL_"):
+        # A tap on one card: confirm it and wait for the other cards
+        index = int(payload.split("_", 2)[1])
+        remaining = len(session.pending())
+        return call_send_api(psid, {"text": f"{session.items[index]['base_item'].title()}: {session.selected[index].title()}. {remaining} more to go.",
+                                    "quick_replies": variation_quick_replies(session)})
+    return ask_for_variations(psid, session)
 
 def process_order_with_variation(psid, order_text):
     """Process order after variation selection"""
@@ -1019,7 +1281,7 @@ def save_order_to_supabase(psid, order_text):
         # Get complete menu name, parse items, and calculate estimated total
         complete_menu_name = get_complete_menu_name(order_text)
         parsed_items = parse_order_items(order_text)
-        estimated_total = sum(item["total"] for item in parsed_items)
+        estimated_total = calculate_order_total(order_text)
         
         url = f"{SUPABASE_URL}/rest/v1/online_orders"
         headers = {
@@ -1182,19 +1444,23 @@ def handle_payload(psid, payload=None, text_message=None):
         user_states[psid] = "awaiting_order"
         return
 
+    cancel_commands = ['cancel', 'stop', 'quit', 'exit', 'no', 'nevermind', 'never mind']
+    
+    if user_states.get(psid) == "awaiting_variation" and text_message:
+        # Typed choices for a pending order, e.g. "small, large" or "all double"
+        # Only a message that is just a cancel command cancels, so "small, no onions" is still read as choices
+        if text_message.lower().strip(" .!") in cancel_commands:
+            return process_variation_selection(psid, payload="VARIATION_CANCEL")
+        return process_variation_selection(psid, text_message=text_message)
+    
     if user_states.get(psid) == "awaiting_order" and text_message:
         # Check for cancellation commands first
         lower_text = text_message.lower().strip()
-        cancel_commands = ['cancel', 'stop', 'quit', 'exit', 'no', 'nevermind', 'never mind']
         
         if any(cmd in lower_text for cmd in cancel_commands):
             user_states.pop(psid, None)
             return send_message_with_quick_replies(psid, "Order cancelled. How can I help you today?")
         
-        # Check if this is a variation selection
-        if user_states.get(psid) == "awaiting_variation":
-            return process_variation_selection(psid, text_message, user_states.get(f"{psid}_original_order", ""))
-        
         # Validate the order text
         is_valid, validation_message = validate_order_text(text_message)
         
@@ -1206,24 +1472,14 @@ def handle_payload(psid, payload=None, text_message=None):
         # Check if order needs variation selection
         items_needing_variations = detect_item_variations(text_message)
         if items_needing_variations:
-            # Store original order text and start variation process
-            user_states[psid] = "awaiting_variation"
-            user_states[f"{psid}_original_order"] = text_message
-            user_states[f"{psid}_variation_items"] = items_needing_variations
-            user_states[f"{psid}_current_variation_index"] = 0
-            
-            # Ask for the first variation
-            current_item = items_needing_variations[0]
-            is_multi_item = len(items_needing_variations) > 1
-            return ask_for_variation(psid, current_item["base_item"], current_item["variations"], 
-                                   is_multi_item=is_multi_item, current_index=0, total_items=len(items_needing_variations))
+            # Ask for every missing choice at once
+            return start_variation_session(psid, text_message, items_needing_variations)
         
         # If valid and no variation needed, process the order
         success, order_number = save_order_to_supabase(psid, text_message)
         
         # Always clear the user state after processing (success or failure)
         user_states.pop(psid, None)
-        user_states.pop(f"{psid}_original_order", None)
         
         if success:
             # Calculate estimated total for display
@@ -1325,14 +1581,18 @@ def webhook():
                         payload = msg["quick_reply"].get("payload")
                         # Handle variation selections
                         if payload and payload.startswith("VARIATION_"):
-                            original_order = user_states.get(f"{psid}_original_order", "")
-                            process_variation_selection(psid, payload, original_order)
+                            process_variation_selection(psid, payload=payload)
                         else:
                             handle_payload(psid, payload=payload)
                     elif "text" in msg:
                         handle_payload(psid, text_message=msg.get("text", "").strip())
                 elif "postback" in event:
-                    handle_payload(psid, payload=event["postback"].get("payload"))
+                    payload = event["postback"].get("payload")
+                    # Variation carousel buttons arrive as postbacks
+                    if payload and payload.startswith("VARIATION_"):
+                        process_variation_selection(psid, payload=payload)
+                    else:
+                        handle_payload(psid, payload=payload)
 
     return Response("EVENT_RECEIVED", status=200)
 
@@ -0,0 +1,83 @@
+"""
+Order quantities shared by the order-text bots (appoldworking.py, app18102025.py)
+"""
+
+import re
+import logging
+from bisect import bisect_right
+from time import perf_counter
+
+logger = logging.getLogger("FBBot")
+
+# One regex pass over the order text finds every quantity ("x2", "2x", "2pcs",
+# "2 orders", plain numbers, English and Tagalog number words) and every clause
+# separator. Suffix forms ("x2", "2 pcs", "2 orders") bind to the item before
+# them, plain numbers and number words to the item after them, preferring the
+# same clause and then the nearest item. Menu mentions that have no price still
+# take part, so their quantity is not handed to a neighbour. Items without a
+# quantity keep 1.
+QUANTITY_MAX = 50
+QUANTITY_WINDOW = 20  # characters between a quantity and its item
+QUANTITY_TIME_BUDGET = 0.005  # seconds per message, items left unbound keep 1
+QUANTITY_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "isa": 1, "isang": 1, "dalawa": 2, "dalawang": 2, "tatlo": 3, "tatlong": 3, "apat": 4, "lima": 5, "limang": 5,
+    "anim": 6, "pito": 7, "pitong": 7, "walo": 8, "walong": 8, "siyam": 9, "sampu": 10, "sampung": 10
+}
+QUANTITY_UNITS = ["pcs", "pc", "pieces", "piece", "orders", "order", "servings", "serving", "plates", "plate", "sets", "set", "x", "×"]
+QUANTITY_PATTERN = re.compile(
+    r"(?P<separator>[,;\n+&]|\b(?:and|at|saka|tsaka)\b)"
+    r"|(?<![\w:])[x×]\s*(?P<times>\d{1,3})(?![\w:]|\.\d)"
+    r"|(?<![\w:₱])(?<!\d\.)(?P<count>\d{1,3})(?:\s*(?P<unit>" + "|".join(QUANTITY_UNITS) + r")(?!\w))?(?![\w:]|\.\d)"
+    r"|\b(?P<word>" + "|".join(sorted(QUANTITY_WORDS, key=len, reverse=True)) + r")\b"
+)
+
+def bind_quantities(text, parsed_items, spans, mention_spans=()):
+    """Set quantity and total of each parsed item (spans[i] is parsed_items[i]) from the quantity bound to it"""
+    deadline = perf_counter() + QUANTITY_TIME_BUDGET
+    # Unpriced menu mentions compete for quantities but have no item to update
+    spans = list(spans) + [mention for mention in mention_spans
+                           if not any(mention[0] < span_end and span_start < mention[1] for span_start, span_end in spans)]
+    inside_item = lambda start, end: any(start < span_end and span_start < end for span_start, span_end in spans)
+
+    # (start, end, value, trailing): suffix forms follow their item, the rest lead it
+    quantities, separators = [], []
+    for match in QUANTITY_PATTERN.finditer(text):
+        if perf_counter() > deadline:
+            logger.warning(f"Quantity time budget exceeded for: '{text[:50]}'")
+            break
+        if inside_item(match.start(), match.end()):
+            continue
+        if match.group("separator"):
+            separators.append(match.start())
+        elif match.group("word"):
+            quantities.append((match.start(), match.end(), QUANTITY_WORDS[match.group("word")], False))
+        else:
+            value = int(match.group("times") or match.group("count"))
+            trailing = bool(match.group("times")) or match.group("unit") not in (None, "x", "×")
+            if 1 <= value <= QUANTITY_MAX:
+                quantities.append((match.start(), match.end(), value, trailing))
+
+    # Each quantity picks a span ranked by (other clause, wrong side, gap); an item keeps its best-ranked quantity
+    bound = {}
+    for start, end, value, trailing in quantities:
+        clause = bisect_right(separators, start)
+        best = None
+        for index, (item_start, item_end) in enumerate(spans):
+            follows = item_start >= end
+            gap = item_start - end if follows else start - item_end
+            if gap < 0 or gap > QUANTITY_WINDOW:
+                continue
+            rank = (bisect_right(separators, item_start) != clause, follows == trailing, gap)
+            if best is None or rank < best[0]:
+                best = (rank, index)
+        if best and (best[1] not in bound or best[0] < bound[best[1]][0]):
+            bound[best[1]] = (best[0], value)
+
+    for index, (_, quantity) in bound.items():
+        if index >= len(parsed_items):
+            continue
+        item = parsed_items[index]
+        item["quantity"] = quantity
+        item["total"] = quantity * item["price"]
+        logger.info(f"Quantity {quantity} for '{item['name']}' = ₱{item['total']}")
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# app.py reads its JSON configs relative to the working directory and opens the
+# local SQLite store on import, so point it at the repo and a throwaway database
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("LOCAL_DB_FILE", os.path.join(tempfile.mkdtemp(prefix="fbbot-tests-"), "bot_local.db"))
@@ -0,0 +1,115 @@
+import random
+import threading
+from collections import Counter, defaultdict
+
+import pytest
+
+import app
+
+PSIDS = [f"psid-{i}" for i in range(40)]
+EVENTS_PER_PSID = 100
+MARKERS = ("✅ Added to cart:", "✅ Order Confirmed!", "🗑️ Cart cleared!", "Your cart is empty.")
+
+@pytest.fixture
+def lanes(monkeypatch):
+    """Run the event workers against a stubbed Send API and order store, recording what each PSID saw"""
+    sent = defaultdict(list)
+    orders = defaultdict(list)
+    handled = defaultdict(list)
+    running = set()
+    overlaps = []
+    lock = threading.Lock()
+    real_handle_payload = app.handle_payload
+
+    def call_send_api(psid, message_data):
+        text = message_data.get("text", "")
+        with lock:
+            sent[psid].append(next((text.split(" - ")[0] for marker in MARKERS if text.startswith(marker)), None))
+        return {"message_id": "stub"}
+
+    def save_order_to_supabase(psid, order_text, cart):
+        with lock:
+            orders[psid].append(Counter({(line.item, line.variation): line.quantity for line in cart}))
+            return True, f"T-{psid}-{len(orders[psid])}"
+
+    def handle_payload(psid, payload=None, text_message=None, mid=None):
+        with lock:
+            if psid in running:
+                overlaps.append((psid, mid))
+            running.add(psid)
+            handled[psid].append(mid)
+        try:
+            real_handle_payload(psid, payload=payload, text_message=text_message, mid=mid)
+        finally:
+            with lock:
+                running.discard(psid)
+
+    monkeypatch.setattr(app, "call_send_api", call_send_api)
+    monkeypatch.setattr(app, "save_order_to_supabase", save_order_to_supabase)
+    monkeypatch.setattr(app, "handle_payload", handle_payload)
+    # Repeat checkouts of the same cart are real orders here, not double taps
+    monkeypatch.setattr(app, "recent_cart_checkouts", app.TTLCache(-1, 1))
+    app.start_event_workers()
+    return sent, orders, handled, overlaps
+
+def menu_lines(count):
+    index = app.get_menu_index()
+    lines = []
+    for item_id, item_entry in sorted(index["items"].items()):
+        for variation_id, variation in sorted(item_entry["variations_by_id"].items()):
+            payload = app.encode_payload("A", index["version"] or 0, item_id, variation_id)
+            lines.append((payload, item_entry["item"]["name"], variation["name"]))
+            break
+        if len(lines) == count:
+            return lines
+    return lines
+
+def test_events_run_in_arrival_order_per_psid(lanes):
+    sent, orders, handled, overlaps = lanes
+    lines = menu_lines(4)
+    rng = random.Random(7)
+    scripts = {psid: [rng.choice(lines + ["CLEAR_CART", "CHECKOUT"]) for _ in range(EVENTS_PER_PSID)] for psid in PSIDS}
+
+    # What each PSID should end up with if its events ran one at a time in order
+    expected_carts, expected_orders, expected_sent = {}, defaultdict(list), defaultdict(list)
+    for psid, script in scripts.items():
+        cart = Counter()
+        for step in script:
+            if step == "CLEAR_CART":
+                cart = Counter()
+                expected_sent[psid].append("🗑️ Cart cleared! Browse our menu to add items.")
+            elif step == "CHECKOUT":
+                if cart:
+                    expected_orders[psid].append(cart)
+                    expected_sent[psid].append("✅ Order Confirmed!\n\nOrder Number: " + f"T-{psid}-{len(expected_orders[psid])}\n\nTotal: ₱")
+                    cart = Counter()
+                else:
+                    expected_sent[psid].append("Your cart is empty. Please add items before checkout.")
+            else:
+                _, item, variation = step
+                cart[item, variation] += 1
+                expected_sent[psid].append(f"✅ Added to cart: {item} ({variation})")
+        expected_carts[psid] = cart
+
+    # Shuffle across PSIDs while keeping each PSID's own events in order
+    events = [(psid, seq) for psid in PSIDS for seq in range(EVENTS_PER_PSID)]
+    rng.shuffle(events)
+    next_seq = defaultdict(int)
+    for psid, _ in events:
+        seq = next_seq[psid]
+        next_seq[psid] += 1
+        step = scripts[psid][seq]
+        app.enqueue_event(psid, {"payload": step if isinstance(step, str) else step[0], "mid": f"{psid}:{seq}"})
+
+    assert app.wait_for_events(timeout=60)
+    assert not overlaps
+    for psid in PSIDS:
+        assert handled[psid] == [f"{psid}:{seq}" for seq in range(EVENTS_PER_PSID)]
+        assert orders[psid] == expected_orders[psid]
+        cart = app.get_user_cart(psid)
+        assert Counter({(line.item, line.variation): line.quantity for line in cart}) == expected_carts[psid]
+        markers = [text for text in sent[psid] if text]
+        assert len(markers) == len(expected_sent[psid])
+        for text, expected in zip(markers, expected_sent[psid]):
+            assert text.startswith(expected)
+    assert not app.event_lanes